@@ -0,0 +1,71 @@
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import vcf_validation
+
+HEADER = (
+    b"##fileformat=VCFv4.2\n"
+    b"#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n"
+)
+
+
+class LaxALTPatternTest(unittest.TestCase):
+    VALID = [
+        b"A", b"g", b"ACGTN", b"*", b".", b"<DEL>", b"<CNV>", b"A,<DEL>,*",
+        # Breakend replacement strings, all four forms, with chr:pos and <ctg>:pos mates.
+        b"G]17:198982]", b"]13:123456]T", b"C[2:321682[", b"[17:198983[A", b"C[<ctg1>:7[",
+        # Single breakends.
+        b".A", b"G.",
+    ]
+    INVALID = [
+        b"", b"X", b"A B", b"A;X", b"A,", b"A,,C", b"<>",
+        # '*' is only valid on its own.
+        b"AT*", b"**",
+        # Breakends need matching brackets and a chr:pos mate.
+        b"A]x[", b"A]17:1[", b"A[17[", b"G]17:1", b"]1:2]", b"A]1:2]T",
+    ]
+
+    def test_valid(self):
+        for alt in self.VALID:
+            with self.subTest(alt=alt):
+                self.assertIsNotNone(vcf_validation._ALT_RE.match(alt))
+
+    def test_invalid(self):
+        for alt in self.INVALID:
+            with self.subTest(alt=alt):
+                self.assertIsNone(vcf_validation._ALT_RE.match(alt))
+
+
+class LaxValidationTest(unittest.TestCase):
+    def validate(self, records):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "lax.vcf")
+            with open(path, "wb") as file:
+                file.write(HEADER + records)
+            output = io.StringIO()
+            with contextlib.redirect_stdout(output):
+                try:
+                    vcf_validation.validate_vcf(path, max_errors=0, strict=False)
+                except SystemExit:
+                    pass
+            return output.getvalue()
+
+    def test_valid_alt_values_pass(self):
+        records = b"".join(b"1\t100\t.\tG\t%s\t.\tPASS\t.\n" % alt for alt in LaxALTPatternTest.VALID)
+        self.assertIn("No structural errors found", self.validate(records))
+
+    def test_alt_checked_after_chrom(self):
+        # ALT is a pattern match, so a cheaper CHROM failure on the same record is reported first.
+        output = self.validate(b"c-1\t100\t.\tG\tAT*\t.\tPASS\t.\n1\t100\t.\tG\tAT*\t.\tPASS\t.\n")
+        self.assertIn("Error: Invalid chromosome on line 3:", output)
+        self.assertIn("Error: Invalid alternate allele on line 4:", output)
+
+
+if __name__ == "__main__":
+    unittest.main()
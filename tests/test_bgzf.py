@@ -0,0 +1,97 @@
+import contextlib
+import io
+import os
+import struct
+import sys
+import tempfile
+import unittest
+import zlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import vcf_validation
+
+HEADER = (
+    b"##fileformat=VCFv4.2\n"
+    b"##contig=<ID=1,length=100000>\n"
+    b"#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tS1\n"
+)
+RECORD = b"1\t%d\tCNV_LOSS_%d\tN\t<CNV>\t30\tPASS\tSVTYPE=CNV;END=%d\tGT:CN\t0/1:1\n"
+
+
+def bgzf_block(data):
+    # Build one BGZF block the way bgzip does: a gzip member with a 'BC' extra subfield holding its size.
+    compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+    cdata = compressor.compress(data) + compressor.flush()
+    block_size = 12 + 6 + len(cdata) + 8
+    return (b"\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff" + struct.pack("<H", 6)
+            + b"BC" + struct.pack("<HH", 2, block_size - 1)
+            + cdata + struct.pack("<II", zlib.crc32(data), len(data)))
+
+
+def bgzf(data, block_size):
+    # Split data into BGZF blocks of block_size bytes, ending with the empty EOF block.
+    blocks = [bgzf_block(data[i:i + block_size]) for i in range(0, len(data), block_size)]
+    return b"".join(blocks) + bgzf_block(b"")
+
+
+def vcf(records):
+    return HEADER + b"".join(RECORD % (pos, pos, pos + 100) for pos in range(1, records + 1))
+
+
+class BGZFTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def write(self, name, data):
+        path = os.path.join(self.tmp.name, name)
+        with open(path, "wb") as file:
+            file.write(data)
+        return path
+
+    def test_lines_rejoined_across_blocks(self):
+        # Small blocks put line breaks mid-block and lines across block boundaries.
+        data = vcf(200)
+        path = self.write("small_blocks.vcf.gz", bgzf(data, 97))
+        expected = data.split(b"\n")[:-1]
+        for threads in (1, 4):
+            with self.subTest(threads=threads):
+                self.assertEqual(list(vcf_validation._iter_lines(path, threads)), expected)
+
+    def test_validate_reports_line_number_across_blocks(self):
+        data = vcf(200).replace(b"CNV_LOSS_150\tN\t<CNV>", b"CNV_LOSS_150\tN\t<DEL>")
+        path = self.write("bad_alt.vcf.gz", bgzf(data, 97))
+        for threads in (1, 4):
+            with self.subTest(threads=threads):
+                output = io.StringIO()
+                with contextlib.redirect_stdout(output), self.assertRaises(SystemExit):
+                    vcf_validation.validate_vcf(path, threads=threads)
+                # Three header lines, so record 150 is on line 153.
+                self.assertIn("Error: Invalid alternate allele on line 153:", output.getvalue())
+
+    def test_truncated_block_raises(self):
+        data = bgzf(vcf(50), 512)
+        path = self.write("truncated.vcf.gz", data[:len(data) // 2])
+        for threads in (1, 4):
+            with self.subTest(threads=threads), self.assertRaises(OSError):
+                list(vcf_validation._iter_lines(path, threads))
+
+    def test_bad_crc_raises(self):
+        block = bytearray(bgzf_block(vcf(5)))
+        block[-8] ^= 0xff
+        path = self.write("bad_crc.vcf.gz", bytes(block) + bgzf_block(b""))
+        for threads in (1, 4):
+            with self.subTest(threads=threads), self.assertRaises(OSError):
+                list(vcf_validation._iter_lines(path, threads))
+
+    def test_corrupt_deflate_data_raises(self):
+        block = bytearray(bgzf_block(vcf(5)))
+        block[20:30] = b"\xff" * 10
+        path = self.write("corrupt.vcf.gz", bytes(block) + bgzf_block(b""))
+        with self.assertRaises(OSError):
+            list(vcf_validation._iter_lines(path, 1))
+
+
+if __name__ == "__main__":
+    unittest.main()
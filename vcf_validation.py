@@ -9,6 +9,15 @@
 # 1.0.0 : WMF : Created.
 # 1.0.1 : WMF : Updated with Congenica rules.
 # 1.0.2 : WMF : Added support for bgzipped files. Updated error message for Alternate Alleles.
+# 1.1.0 :     : Faster bytes-based parsing, BGZF block decompression and new command line options.
+#               - New options: --threads (decompress BGZF blocks on several threads), --max-errors (report up
+#                 to N invalid records, 0 for all) and --lax (skip the Congenica strict rules).
+#               - Duplicate sample names in the #CHROM header line are now rejected.
+#               - "##" lines after the first record are now reported as invalid records instead of being skipped.
+#               - Records with leading whitespace are now rejected.
+#               - When a record has several problems, the error reported is the first in check order (ALT, INFO,
+#                 FORMAT, ID LOSS/GAIN, POS, REF, CHROM, ID, QUAL, FILTER) rather than the leftmost column. With
+#                 --lax the order is POS, REF, CHROM, ALT, ID, QUAL, FILTER.
 #
 # Header line syntax
 # ------------------
@@ -32,117 +41,369 @@
 # ID must contain "LOSS" or "GAIN"
 # FORMAT field must have "CN"
 
+import argparse
+import collections
+import concurrent.futures
+import io
+import itertools
+import os
+import struct
 import sys
 import re
 import gzip
+import mmap
+import zlib
+
+# Field patterns are compiled once here rather than looked up in re's cache on every record. Records are
+# validated as bytes, so the patterns are bytes patterns.
+_ID_RE = re.compile(rb"^([A-Za-z0-9:_.]+(;[A-Za-z0-9_.]+)*)?$")
+_QUAL_RE = re.compile(rb"^[0-9]+(\.[0-9]+)?$")
+_FILTER_RE = re.compile(rb"^([A-Za-z0-9_]+(;[A-Za-z0-9_]+)*)?$|^\.$")
+# An ALT allele is bases, '*' on its own, a symbolic <ID>, a breakend replacement string in one of the four
+# forms t[p[, t]p], ]p]t or [p[t (p is the mate position, chr:pos or <ctg>:pos), or a single breakend such as
+# .A or G. ALT is a comma-separated list of alleles, or "." if missing.
+_BREAKEND_MATE = rb"([^\[\]\s:,<>]+|<[^<>\[\]\s,]+>):[0-9]+"
+_ALT_ALLELE = (rb"(\*|[ACGTN]+|<[^<>,\s]+>"
+               rb"|[ACGTN]+\[" + _BREAKEND_MATE + rb"\[|[ACGTN]+\]" + _BREAKEND_MATE + rb"\]"
+               rb"|\]" + _BREAKEND_MATE + rb"\][ACGTN]+|\[" + _BREAKEND_MATE + rb"\[[ACGTN]+"
+               rb"|\.[ACGTN]+|[ACGTN]+\.)")
+_ALT_RE = re.compile(rb"^(" + _ALT_ALLELE + rb"(," + _ALT_ALLELE + rb")*|\.)$", re.IGNORECASE)
+_LOSS_OR_GAIN = re.compile(rb"LOSS|GAIN")
+
+# Fields that are a plain character class are checked with bytes.translate() instead of a pattern: the field
+# is valid if deleting every allowed character leaves nothing behind.
+_REF_BASES = b"ACGTN"
+_CHROM_CHARS = b"0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz_"
+
+_READ_BUFFER_SIZE = 1 << 20
+_VALID_CACHE_SIZE = 1024
+_BGZF_MAGIC = b"\x1f\x8b\x08\x04"
+
+_CNV_ALT_HINT = "ALT must be \\<CNV\\> for copy number variants."
+
+class VCFValidationError(Exception):
+    # A line of the file that breaks one of the validation rules. hint is optional extra guidance printed
+    # after the error.
+    def __init__(self, message, line_number, line, hint=None):
+        super().__init__(message, line_number, line)
+        self.message = message
+        self.line_number = line_number
+        self.line = line
+        self.hint = hint
+
+    def __str__(self):
+        # Lines are only decoded for display, once, when the error is reported.
+        text = self.line.rstrip(b'\r\n').decode('utf-8', 'replace')
+        error = f"Error: {self.message} on line {self.line_number}: {text}"
+        if self.hint:
+            error += "\n" + self.hint
+        return error
+
+def _non_negative_int(value):
+    # argparse type for counts where 0 has a meaning of its own, such as "no limit".
+    try:
+        number = int(value)
+    except ValueError:
+        number = -1
+    if number < 0:
+        raise argparse.ArgumentTypeError(f"must be an integer of 0 or greater, got {value!r}")
+    return number
+
+def _positive_int(value):
+    # argparse type for counts that must be at least 1, such as a number of threads.
+    try:
+        number = int(value)
+    except ValueError:
+        number = 0
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be an integer of 1 or greater, got {value!r}")
+    return number
 
 def main():
-    if len(sys.argv) != 2:
-        print("Usage: python vcf_validation.py <*.vcf|*.gz>")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description="Validate a VCFv4.2 file, by default against the Congenica strict rules.")
+    parser.add_argument("vcf_file", metavar="<*.vcf|*.gz>", help="VCF file, plain or bgzipped")
+    parser.add_argument("--threads", type=_positive_int, default=1,
+                        help="number of threads used to decompress bgzipped input (default: 1)")
+    parser.add_argument("--max-errors", type=_non_negative_int, default=1,
+                        help="stop after reporting this many invalid records, 0 for no limit (default: 1)")
+    parser.add_argument("--lax", dest="strict", action="store_false",
+                        help="check VCFv4.2 column syntax only, skipping the Congenica strict rules")
+    args = parser.parse_args()
+    if not args.vcf_file.endswith(('.vcf', '.gz')):
+        parser.error(f"file type not recognised: {args.vcf_file} (expected *.vcf or *.gz)")
+
+    validate_vcf(args.vcf_file, threads=args.threads, max_errors=args.max_errors, strict=args.strict)
+
+def _read_bgzf_blocks(file):
+    # Yield (deflate data, trailer) for each BGZF block in file. Every block is a complete gzip member whose
+    # header carries its total size in a 'BC' extra subfield, so blocks can be cut out without inflating them.
+    while True:
+        header = file.read(12)
+        if not header:
+            return
+        if len(header) < 12 or header[:4] != _BGZF_MAGIC:
+            raise OSError("Invalid BGZF block header")
+        xlen = int.from_bytes(header[10:12], 'little')
+        extra = file.read(xlen)
+        block_size = None
+        pos = 0
+        while pos + 4 <= len(extra):
+            subfield_len = int.from_bytes(extra[pos + 2:pos + 4], 'little')
+            if extra[pos:pos + 2] == b'BC' and subfield_len == 2:
+                block_size = int.from_bytes(extra[pos + 4:pos + 6], 'little') + 1
+            pos += 4 + subfield_len
+        if block_size is None:
+            raise OSError("BGZF block is missing its BC size field")
+        if block_size < 12 + xlen + 8:
+            raise OSError("BGZF block size is too small")
+        body = file.read(block_size - 12 - xlen)
+        if len(body) != block_size - 12 - xlen:
+            raise OSError("Truncated BGZF block")
+        yield body[:-8], body[-8:]
 
-    vcf_file = sys.argv[1]
-    validate_vcf(vcf_file)
+def _inflate_bgzf_block(block):
+    # Inflate one block and check it against the CRC32 and size in its trailer. zlib releases the GIL while
+    # it works, so this can run on worker threads.
+    data, trailer = block
+    try:
+        data = zlib.decompress(data, -15)
+    except zlib.error as error:
+        raise OSError(f"Corrupt BGZF block: {error}") from error
+    crc, size = struct.unpack('<II', trailer)
+    if zlib.crc32(data) != crc or len(data) != size:
+        raise OSError("BGZF block failed its CRC check")
+    return data
 
-def validate_vcf(vcf_file):
-    if vcf_file.endswith('.vcf'):
-        open_func = open
-    elif vcf_file.endswith('.gz'):
-        open_func = gzip.open
-    else:
+def _inflate_bgzf(file, threads):
+    # Yield the decompressed contents of file one block at a time, in order. With more than one thread,
+    # blocks are inflated on a pool while the caller validates the blocks already yielded.
+    blocks = _read_bgzf_blocks(file)
+    if threads <= 1:
+        yield from map(_inflate_bgzf_block, blocks)
+        return
+
+    with concurrent.futures.ThreadPoolExecutor(threads) as pool:
+        pending = collections.deque()
+        for block in blocks:
+            pending.append(pool.submit(_inflate_bgzf_block, block))
+            if len(pending) >= threads * 4:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def _split_lines(chunks):
+    # Yield the lines in a stream of byte chunks, joining lines that straddle chunk boundaries.
+    tail = b''
+    for chunk in chunks:
+        lines = (tail + chunk).split(b'\n')
+        tail = lines.pop()
+        yield from lines
+    if tail:
+        yield tail
+
+def _iter_lines(vcf_file, threads=1):
+    # Yield the lines of the file as bytes. Plain VCFs are memory-mapped and walked with find() so no
+    # str is decoded per line. BGZF files are cut into blocks and inflated directly with zlib, on several
+    # threads if asked. Other gzip files are streamed through gzip in binary mode behind a large read
+    # buffer, so lines are cut from 1 MiB of decompressed data at a time rather than gzip's default 8 KiB.
+    if vcf_file.endswith('.gz'):
+        with open(vcf_file, 'rb', buffering=_READ_BUFFER_SIZE) as raw:
+            header = raw.peek(18)[:18]
+            if header[:4] == _BGZF_MAGIC and header[12:14] == b'BC':
+                yield from _split_lines(_inflate_bgzf(raw, threads))
+            else:
+                with io.BufferedReader(gzip.GzipFile(fileobj=raw), buffer_size=_READ_BUFFER_SIZE) as file:
+                    yield from file
+        return
+
+    with open(vcf_file, 'rb') as file:
+        size = os.fstat(file.fileno()).st_size
+        if size == 0:
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            pos = 0
+            while pos < size:
+                nl = mm.find(b'\n', pos)
+                if nl < 0:
+                    nl = size
+                yield mm[pos:nl]
+                pos = nl + 1
+
+def _consume_header(lines, strict):
+    # Consume the meta-information lines and the #CHROM header line. Returns the number of lines consumed
+    # and the first record line, or None if the file has no records.
+    line_number = 0
+    for line in lines:
+        line_number += 1
+        # ##contig lines are tested first as they are the bulk of a large header; every other header line
+        # is recognised by a single startswith() against both header prefixes.
+        if line.startswith(b"##contig"):
+            # Congenica strict rule: contig IDs must not start with 'chr'.
+            if not strict:
+                continue
+            # Locate the ID attribute in place rather than splitting the attribute list apart; it is
+            # either the first attribute or follows a comma.
+            id_start = line.find(b'<ID=')
+            if id_start < 0:
+                id_start = line.find(b',ID=')
+            if id_start >= 0 and line.startswith(b"chr", id_start + 4):
+                raise VCFValidationError("Contig ID starts with 'chr'", line_number, line)
+        elif not line.startswith((b"##", b"#CHROM")):
+            return line_number, line
+        elif line.startswith(b"#CHROM"):
+            # Sample IDs follow the FORMAT column and must be unique. One pass picks out every repeat, so
+            # the error can name them.
+            seen = set()
+            duplicates = []
+            for sample in line.rstrip(b'\r\n').split(b'\t')[9:]:
+                if sample in seen:
+                    duplicates.append(sample)
+                else:
+                    seen.add(sample)
+            if duplicates:
+                names = ", ".join(sorted({sample.decode('utf-8', 'replace') for sample in duplicates}))
+                raise VCFValidationError(f"Duplicate sample names in header ({names})", line_number, line)
+    return line_number, None
+
+def _consume_records(lines, first_line, line_number, strict):
+    # Validate first_line, which is on line_number, and every line after it, yielding a VCFValidationError
+    # for each invalid record. Validation carries on past a bad record for as long as the caller keeps
+    # asking for errors. Everything past the header is a record, so there is no header check in this loop.
+    #
+    # This is the hot loop. The checks are written inline rather than called per field, and the compiled
+    # matchers are bound to locals up front, so a record costs no Python calls or global lookups beyond
+    # the checks themselves. The Congenica strict rules sit behind a single test of the local strict flag,
+    # so lax validation skips them outright and strict validation pays one branch per record for them.
+    id_match = _ID_RE.match
+    alt_match = _ALT_RE.match
+    loss_or_gain = _LOSS_OR_GAIN.search
+    qual_match = _QUAL_RE.match
+    filter_match = _FILTER_RE.match
+    ref_bases = _REF_BASES
+    chrom_chars = _CHROM_CHARS
+    # Congenica requires the FORMAT column; VCFv4.2 only requires the 8 columns before it.
+    min_columns = 9 if strict else 8
+    # CHROM and FILTER values come from a small vocabulary that repeats on nearly every record, so values
+    # that have already passed are remembered and not matched again. The caches are capped so memory stays
+    # bounded on files where they don't repeat.
+    valid_chroms = set()
+    valid_filters = set()
+    for line_number, line in enumerate(itertools.chain((first_line,), lines), line_number):
+        # Only the 9 fixed columns are validated, so stop splitting there: sample columns are left
+        # together, unsplit, in fields[9] and never looked at. Only the line ending is trimmed; records
+        # never start with whitespace, so a full strip() would just be a second pass over the line.
+        fields = line.rstrip(b'\r\n').split(b'\t', 9)
+        if len(fields) < min_columns:
+            yield VCFValidationError("Incorrect number of columns", line_number, line)
+            continue
+        chrom, pos, id_, ref, alt, qual, filter_, info = fields[:8]
+
+        # The checks run cheapest first: bytes comparison and substring search (the strict rules), then
+        # single C-level scans (POS, REF, CHROM), then the pattern matches. A record that fails a cheap check
+        # is rejected before any regex runs, and a record with several problems reports the cheapest one.
+
+        if strict:
+            # Congenica strict rules: ALT must be <CNV>, INFO must contain SVTYPE=CNV, FORMAT must contain
+            # "CN" and ID must contain "LOSS" or "GAIN". In lax mode ALT is checked against the general
+            # VCFv4.2 syntax instead, with the other pattern matches below.
+            #
+            # ALT, INFO and FORMAT are deliberately a bytes comparison and plain `in` tests, not patterns: `in`
+            # on bytes is CPython's C substring search and stops at the first hit, so a leading SVTYPE=CNV is
+            # found within a few bytes however long INFO is. Don't bound the scan with a slice either; that
+            # copies the field and would reject valid records whose SVTYPE key is not near the start.
+            if alt != b"<CNV>":
+                yield VCFValidationError("Invalid alternate allele", line_number, line, hint=_CNV_ALT_HINT)
+                continue
+
+            # INFO - Additional information. encoded as a semicolon-separated series of short keys with optional values in the format: <key>=<data>[,data].
+            # String, no whitespace, semicolons, or equals-signs permitted; commas are permitted only as delimiters for lists of values). Missing values
+            # are denoted by ".".
+            # INFO field (field 7) must contain SVTYPE=CNV
+            if b"SVTYPE=CNV" not in info:
+                yield VCFValidationError("Missing SVTYPE=CNV in INFO field", line_number, line)
+                continue
+
+            # FORMAT field (field 8) must contain "CN"
+            if b"CN" not in fields[8]:
+                yield VCFValidationError("Missing 'CN' in FORMAT field", line_number, line)
+                continue
+
+            # ID field must contain in the string somewhere "LOSS" or "GAIN"
+            if loss_or_gain(id_) is None:
+                yield VCFValidationError("ID field doesn't contain 'LOSS' or 'GAIN'", line_number, line)
+                continue
+
+        # POS - Position. The reference position, with the 1st base having position 1. Positions are sorted numerically, in increasing order,
+        # within each reference sequence CHROM. Integer, Required.
+        if not pos.isdigit():
+            yield VCFValidationError("Invalid position", line_number, line)
+            continue
+
+        # REF - Reference base(s). Each base must be one of A,C,G,T,N (case insensitive). Multiple bases are permitted.
+        # String, Required.
+        if not ref or ref.translate(None, ref_bases):
+            yield VCFValidationError("Invalid reference allele", line_number, line)
+            continue
+
+        # CHROM - Chromosome. An identifier from the reference genome or an angle-bracketed ID String (“<ID>”).
+        # String, no whitespace permitted, Required.
+        if chrom not in valid_chroms:
+            if not chrom or chrom.translate(None, chrom_chars):
+                yield VCFValidationError("Invalid chromosome", line_number, line)
+                continue
+            if len(valid_chroms) < _VALID_CACHE_SIZE:
+                valid_chroms.add(chrom)
+
+        # ALT - Altnerate base(s). Comma-separated list of alternate non-reference alleles.  Strings made up of the bases A,C,G,T,N,*, (case insensitive)
+        # or an angle-bracketed ID String (“<ID>”) or a breakend replacement string. String; no whitespace, commas, or angle-brackets are permitted
+        # in the ID String itself. Missing values denoted by ".".
+        if not strict and not alt_match(alt):
+            yield VCFValidationError("Invalid alternate allele", line_number, line)
+            continue
+
+        # ID - Identifier. Semicolon-separated list of unique identifiers where available.
+        # String, no whitespace or semicolons permitted. Missing values denoted by ".".
+        if not id_match(id_):
+            yield VCFValidationError("Invalid ID", line_number, line)
+            continue
+
+        # QUAL - Quality. Phred-scaled quality score for the assertion made in ALT. Numeric, missing values are denoted by ".".
+        if qual != b"." and not qual_match(qual):
+            yield VCFValidationError("Invalid quality", line_number, line)
+            continue
+
+        # FILTER - Filter status. PASS if this position has passed all filters, i.e., a call is made at this position. Otherwise, if the site has not
+        # passed all filters, a semicolon-separated list of codes for filters that fail. String, no whitespace or semicolons permitted. Missing
+        # values denoted by ".".
+        if filter_ not in valid_filters:
+            if not filter_match(filter_):
+                yield VCFValidationError("Invalid filter", line_number, line)
+                continue
+            if len(valid_filters) < _VALID_CACHE_SIZE:
+                valid_filters.add(filter_)
+
+def validate_vcf(vcf_file, threads=1, max_errors=1, strict=True):
+    if not vcf_file.endswith(('.vcf', '.gz')):
         print("File type not recognised.")
-        print("Usage: python vcf_validation.py <*.vcf|*.gz>")
         sys.exit(1)
-    
-    with open_func(vcf_file, 'rt') as file:
-        ...
-
-        line_number = 0
-        header_found = False
-        for line in file:
-            line_number += 1
-            if line.startswith("##"):
-                if line.startswith("##contig"):
-                    contig_info = line.split('<',1)[1].split('>')[0]
-                    id_info = [x for x in contig_info.split(',') if x.startswith('ID=')]
-                    if id_info:
-                        contig_id = id_info[0].split('=')[1]
-                        if contig_id.startswith("chr"):
-                            print(f"Error: Contig ID starts with 'chr' on line {line_number}: {line.strip()}")
-                            sys.exit(1)
-                            
-                if not header_found:
-                    header_found = True
-                continue
-            elif line.startswith("#CHROM"):
-                header_found = False
-            else:
-                fields = line.strip().split('\t')
-                if len(fields) < 9:
-                    print(f"Error: Incorrect number of columns on line {line_number}: {line.strip()}")
-                    sys.exit(1)
-                
-                # CHROM - Chromosome. An identifier from the reference genome or an angle-bracketed ID String (“<ID>”).
-                # String, no whitespace permitted, Required.
-                if not re.match("^[0-9A-Za-z_]+$", fields[0]):
-                    print(f"Error: Invalid chromosome on line {line_number}: {line.strip()}")
-                    sys.exit(1)
-
-                # POS - Position. The reference position, with the 1st base having position 1. Positions are sorted numerically, in increasing order,
-                # within each reference sequence CHROM. Integer, Required.
-                if not re.match("^[0-9]+$", fields[1]):
-                    print(f"Error: Invalid position on line {line_number}: {line.strip()}")
-                    sys.exit(1)
-
-                # ID - Identifier. Semicolon-separated list of unique identifiers where available.
-                # String, no whitespace or semicolons permitted. Missing values denoted by ".".
-                if not re.match("^([A-Za-z0-9:_.]+(;[A-Za-z0-9_.]+)*)?$", fields[2]):
-                    print(f"Error: Invalid ID on line {line_number}: {line.strip()}")
-                    sys.exit(1)
-                # ID field must contain in the string somewhere "LOSS" or "GAIN"
-                if "LOSS" not in fields[2] and "GAIN" not in fields[2]:
-                    print(f"Error: ID field doesn't contain 'LOSS' or 'GAIN' on line {line_number}: {line.strip()}")
-                    sys.exit(1)
-
-                # REF - Reference base(s). Each base must be one of A,C,G,T,N (case insensitive). Multiple bases are permitted.
-                # String, Required.
-                if not re.match("^[ACGTN]+$", fields[3]):
-                    print(f"Error: Invalid reference allele on line {line_number}: {line.strip()}")
-                    sys.exit(1)
-
-                # ALT - Altnerate base(s). Comma-separated list of alternate non-reference alleles.  Strings made up of the bases A,C,G,T,N,*, (case insensitive)
-                # or an angle-bracketed ID String (“<ID>”) or a breakend replacement string. String; no whitespace, commas, or angle-brackets are permitted
-                # in the ID String itself. Missing values denoted by ".".
-                if fields[4] != "<CNV>":
-                #if not re.match("^([ACGTN]+|<[^>]+>)(,([ACGTN]+|<[^>]+>))*$", fields[4]):
-                    print(f"Error: Invalid alternate allele on line {line_number}: {line.strip()}")
-                    print(f"ALT must be \<CNV\> for copy number variants.")
-                    sys.exit(1)
-
-                # QUAL - Quality. Phred-scaled quality score for the assertion made in ALT. Numeric, missing values are denoted by ".".
-                if not re.match("^[0-9]+(\.[0-9]+)?$", fields[5]) and fields[5] != ".":
-                    print(f"Error: Invalid quality on line {line_number}: {line.strip()}")
-                    sys.exit(1)
-
-                # FILTER - Filter status. PASS if this position has passed all filters, i.e., a call is made at this position. Otherwise, if the site has not
-                # passed all filters, a semicolon-separated list of codes for filters that fail. String, no whitespace or semicolons permitted. Missing
-                # values denoted by ".".
-                if not re.match("^([A-Za-z0-9_]+(;[A-Za-z0-9_]+)*)?$|^\\.$", fields[6]):
-                    print(f"Error: Invalid filter on line {line_number}: {line.strip()}")
-                    sys.exit(1)
-
-                # INFO - Additional information. encoded as a semicolon-separated series of short keys with optional values in the format: <key>=<data>[,data].
-                # String, no whitespace, semicolons, or equals-signs permitted; commas are permitted only as delimiters for lists of values). Missing values
-                # are denoted by ".".
-                # INFO field (field 7) must contain SVTYPE=CNV
-                if "SVTYPE=CNV" not in fields[7]:
-                    print(f"Error: Missing SVTYPE=CNV in INFO field on line {line_number}: {line.strip()}")
-                    sys.exit(1)
-
-                # FORMAT field (field 8) must contain "CN"
-                if "CN" not in fields[8]:
-                    print(f"Error: Missing 'CN' in FORMAT field on line {line_number}: {line.strip()}")
-                    sys.exit(1)
+
+    # Errors are printed as they are found. Validation stops after max_errors of them, or carries on to the
+    # end of the file if max_errors is 0. A bad header line always stops validation.
+    error_count = 0
+    lines = _iter_lines(vcf_file, threads)
+    try:
+        line_number, first_record = _consume_header(lines, strict)
+        if first_record is not None:
+            errors = _consume_records(lines, first_record, line_number, strict)
+            for error in itertools.islice(errors, max_errors or None):
+                print(error)
+                error_count += 1
+    except VCFValidationError as error:
+        print(error)
+        error_count += 1
+
+    if error_count:
+        sys.exit(1)
 
     print("VCF file validation completed. No structural errors found.")
 